@@ -3,7 +3,7 @@ CREATE TABLE
         id INT AUTO_INCREMENT PRIMARY KEY,
         username VARCHAR(50) UNIQUE NOT NULL,
         email   VARCHAR(100)    UNIQUE,
-        password VARCHAR(64) NOT NULL,
+        password VARCHAR(255) NOT NULL,
         role ENUM ('user', 'businessOwner', 'moderator', 'admin') DEFAULT 'user',
         token VARCHAR(64)
     );
@@ -32,4 +32,6 @@ CREATE TABLE IF NOT EXISTS reviews (
 
 -- Нужные индексы
 CREATE INDEX idx_reviews_place_id ON reviews(place_id);
-CREATE INDEX idx_reviews_user_id  ON reviews(user_id);
\ No newline at end of file
+CREATE INDEX idx_reviews_user_id  ON reviews(user_id);
+-- auth_required ищет пользователя по токену на каждый запрос
+CREATE UNIQUE INDEX idx_users_token ON users(token);
\ No newline at end of file
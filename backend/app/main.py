@@ -1,14 +1,36 @@
 import re
 import os
+import base64
 import json
 import hashlib
+import hmac
+import itertools
 import secrets
 import ssl
-import pymysql
+import threading
+import time
+from contextlib import contextmanager
 from decimal import Decimal
 from datetime import datetime, date
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from queue import Queue, Empty, Full
 from urllib.parse import parse_qs, urlparse
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+# mysqlclient (C-обёртка над libmysqlclient) разбирает строки результата в C;
+# без него — чистый Python pymysql с тем же DB-API
+try:
+    import MySQLdb as mysql_driver
+    from MySQLdb.cursors import DictCursor, SSDictCursor
+except ImportError:
+    import pymysql as mysql_driver
+    from pymysql.cursors import DictCursor, SSDictCursor
+
+try:
+    import orjson
+except ImportError:  # без orjson работаем на stdlib json
+    orjson = None
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 CERT_FILE = os.path.join(SCRIPT_DIR, "cert.pem")
@@ -20,10 +42,59 @@ DB_PASSWORD = os.getenv('MYSQL_PASSWORD', 'fastapi_pass')
 DB_NAME = os.getenv('MYSQL_DATABASE', 'fastapi_db')
 DB_HOST = os.getenv('DB_HOST', 'db')
 DB_PORT = os.getenv('DB_PORT', '3306')
+# Сколько готовых соединений держим в пуле и через сколько секунд простоя пингуем перед выдачей
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '16'))
+# Потолок одновременно занятых соединений: сверх него потоки ждут, а не открывают новые
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', '32'))
+DB_POOL_PING_AFTER = 60
+
+# Где слушаем. За nginx (docker compose --profile tls) TLS терминирует прокси, а здесь — plain HTTP
+LISTEN_HOST = os.getenv('LISTEN_HOST', '0.0.0.0')
+LISTEN_PORT = int(os.getenv('LISTEN_PORT', '8443'))
 
 ROLES = ['user', 'businessOwner', 'moderator', 'admin']
 ALLOWED_SELF_REGISTER_ROLES = {"user", "businessOwner"}
+# UPDATE users на каждый непустой набор редактируемых колонок — всего 7 фиксированных строк SQL;
+# values в update_user добавляются в том же порядке, что и колонки здесь
+_USER_UPDATE_COLUMNS = ('username', 'password', 'role')
+_USER_UPDATE_SQL = {
+    frozenset(cols): "UPDATE users SET " + ", ".join(f"{c}=%s" for c in cols) + " WHERE id=%s"
+    for n in range(1, len(_USER_UPDATE_COLUMNS) + 1)
+    for cols in itertools.combinations(_USER_UPDATE_COLUMNS, n)
+}
 EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+_MATCH_EMAIL = EMAIL_RE.match
+# Пароли: argon2id с фиксированными параметрами — предсказуемые ~CPU/память на один логин.
+# Хэши старого формата (голый sha256 hexdigest) проверяем и перехешируем при входе
+_PASSWORD_HASHER = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+_LEGACY_PASSWORD_RE = re.compile(r'^[0-9a-f]{64}$')
+# Одновременных argon2 не больше числа ядер: каждый берёт ~19 MiB, а потоков у
+# ThreadingHTTPServer сколько угодно. Отдельно от _POOL_SLOTS — KDF идёт без соединения
+_KDF_SLOTS = threading.BoundedSemaphore(os.cpu_count() or 2)
+# Для несуществующего логина проверяем пароль против этого хэша, чтобы по времени
+# ответа нельзя было отличить «нет такого пользователя» от «неверный пароль»
+_DUMMY_PASSWORD_HASH = _PASSWORD_HASHER.hash(secrets.token_urlsafe(16))
+# generate_token отдаёт token_urlsafe(32) (43 символа); ещё живые токены старого формата —
+# sha256 hexdigest (64 hex). Всё остальное даже не ищем в БД
+_TOKEN_RE = re.compile(r'^(?:[A-Za-z0-9_-]{43}|[0-9a-f]{64})$')
+
+# GET /users отдаёт страницами: размер по умолчанию и максимум
+# Верхняя граница знакового INT в MySQL — id больше неё в таблицах не бывает
+INT_MAX = 2**31 - 1
+
+USERS_PAGE_DEFAULT = 100
+USERS_PAGE_MAX = 500
+
+# Keep-alive: через сколько секунд тишины закрываем соединение клиента.
+# keepalive_timeout в upstream nginx/nginx.conf должен быть меньше этого значения
+KEEPALIVE_TIMEOUT = 30
+
+# Списки отдаём потоком: сколько строк тянем из курсора и кладём в один кусок ответа
+STREAM_BATCH_ROWS = 256
+
+# Кэш токенов: сколько секунд держим проверенный токен и сколько токенов максимум
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', '60'))
+TOKEN_CACHE_MAXSIZE = int(os.getenv('TOKEN_CACHE_MAXSIZE', '10000'))
 
 # CORS: добавь сюда свои фронтовые origin'ы
 ALLOWED_ORIGINS = {
@@ -34,17 +105,127 @@ ALLOWED_ORIGINS = {
 }
 # Если хочешь максимально расслабить на dev: ALLOWED_ORIGINS = set() и мы вернём "*"
 
+# ================== TOKEN CACHE ==================
+# token -> (expires_at, user); user_id -> {token, ...} для инвалидации по пользователю.
+# gen растёт при каждой инвалидации: SELECT, начатый до смены роли, не положит в кэш старую роль
+_TOKEN_CACHE = {}
+_TOKEN_CACHE_BY_USER = {}
+_TOKEN_CACHE_STATE = {'gen': 0}
+_TOKEN_CACHE_LOCK = threading.RLock()
+
+def _drop_cached_token(token):
+    entry = _TOKEN_CACHE.pop(token, None)
+    if entry is None:
+        return
+    uid = entry[1]['id']
+    tokens = _TOKEN_CACHE_BY_USER.get(uid)
+    if tokens is not None:
+        tokens.discard(token)
+        if not tokens:
+            del _TOKEN_CACHE_BY_USER[uid]
+
+def get_cached_user(token):
+    """Пользователь по токену из кэша или None, если его нет или он протух"""
+    with _TOKEN_CACHE_LOCK:
+        entry = _TOKEN_CACHE.get(token)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            _drop_cached_token(token)
+            return None
+        return user
+
+def token_cache_generation():
+    with _TOKEN_CACHE_LOCK:
+        return _TOKEN_CACHE_STATE['gen']
+
+def cache_user(token, user, gen):
+    with _TOKEN_CACHE_LOCK:
+        if gen != _TOKEN_CACHE_STATE['gen']:
+            return
+        _drop_cached_token(token)
+        if len(_TOKEN_CACHE) >= TOKEN_CACHE_MAXSIZE:
+            now = time.monotonic()
+            for t in [t for t, (exp, _) in _TOKEN_CACHE.items() if exp <= now]:
+                _drop_cached_token(t)
+        while len(_TOKEN_CACHE) >= TOKEN_CACHE_MAXSIZE:
+            # dict хранит порядок вставки — выкидываем самый старый
+            _drop_cached_token(next(iter(_TOKEN_CACHE)))
+        _TOKEN_CACHE[token] = (time.monotonic() + TOKEN_CACHE_TTL, user)
+        _TOKEN_CACHE_BY_USER.setdefault(user['id'], set()).add(token)
+
+def evict_user_tokens(user_id):
+    """Сбросить все закэшированные токены пользователя (логин, смена роли, удаление)"""
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE_STATE['gen'] += 1
+        for token in _TOKEN_CACHE_BY_USER.pop(user_id, set()):
+            _TOKEN_CACHE.pop(token, None)
+
+# ================== PLACES CACHE =================
+# Готовый ответ GET /places + его ETag; gen растёт при каждой инвалидации,
+# чтобы запрос, начатый до изменения, не положил в кэш устаревший список
+_PLACES_CACHE = {'etag': None, 'response': None, 'gen': 0}
+_PLACES_CACHE_LOCK = threading.Lock()
+
+def invalidate_places_cache():
+    with _PLACES_CACHE_LOCK:
+        _PLACES_CACHE['etag'] = None
+        _PLACES_CACHE['response'] = None
+        _PLACES_CACHE['gen'] += 1
+
 # ================== HELPERS ======================
-def generate_token(user_id):
-    raw = f"{user_id}:{secrets.token_hex(16)}"
-    return hashlib.sha256(raw.encode()).hexdigest()
+# Случайные байты берём из os.urandom пачками: один системный вызов на ~128 токенов
+_RAND_POOL = bytearray()
+_RAND_LOCK = threading.Lock()
+
+def _rand32() -> bytes:
+    with _RAND_LOCK:
+        if len(_RAND_POOL) < 32:
+            _RAND_POOL.extend(os.urandom(4096))
+        out = bytes(_RAND_POOL[:32])
+        del _RAND_POOL[:32]
+    return out
+
+def generate_token():
+    # 32 байта из CSPRNG уже уникальны — хэшировать их поверх нечего.
+    # Формат тот же, что у secrets.token_urlsafe(32): 43 символа base64url
+    return base64.urlsafe_b64encode(_rand32()).rstrip(b'=').decode('ascii')
+
+def hash_password(passwd: str) -> str:
+    with _KDF_SLOTS:
+        return _PASSWORD_HASHER.hash(passwd)
+
+def _dummy_verify(passwd: str):
+    try:
+        with _KDF_SLOTS:
+            _PASSWORD_HASHER.verify(_DUMMY_PASSWORD_HASH, passwd)
+    except VerificationError:
+        pass
+
+def verify_password(stored: str, passwd: str):
+    """(пароль подошёл, хэш пора пересчитать)"""
+    if _LEGACY_PASSWORD_RE.match(stored):
+        ok = hmac.compare_digest(stored, hashlib.sha256(passwd.encode()).hexdigest())
+        if not ok:
+            # неудачный вход должен стоить как полный argon2 — иначе быстрый 401
+            # выдаёт существующего пользователя со старым хэшем
+            _dummy_verify(passwd)
+        return ok, ok
+    try:
+        with _KDF_SLOTS:
+            _PASSWORD_HASHER.verify(stored, passwd)
+    except (VerificationError, InvalidHashError):
+        return False, False
+    return True, _PASSWORD_HASHER.check_needs_rehash(stored)
 
 def parse_json(request):
     content_length = int(request.headers.get('Content-Length', 0))
     body = request.rfile.read(content_length)
+    request.body_consumed = True
     if not body:
         return {}
-    return json.loads(body.decode('utf-8'))
+    return json_loads(body)
 
 def _json_default(o):
     if isinstance(o, Decimal):
@@ -53,9 +234,23 @@ def _json_default(o):
         return o.isoformat()
     raise TypeError(f'Object of type {o.__class__.__name__} is not JSON serializable')
 
+# Обе версии принимают bytes и отдают bytes — снаружи разницы не видно
+if orjson is not None:
+    def json_dumps(obj) -> bytes:
+        return orjson.dumps(obj, default=_json_default)
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj) -> bytes:
+        # как orjson: UTF-8 без \uXXXX-эскейпов и без пробелов между токенами
+        return json.dumps(obj, default=_json_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    json_loads = json.loads
+
 def json_response(response, status=200, headers=None):
     """Единая корректная версия: возвращает (status, [(k,v)...], payload)"""
-    payload = json.dumps(response, default=_json_default).encode('utf-8')
+    return encoded_json_response(json_dumps(response), status, headers)
+
+def encoded_json_response(payload, status=200, headers=None):
+    """То же, что json_response, но payload уже сериализован в bytes"""
     base_headers = [
         ('Content-Type', 'application/json; charset=utf-8'),
         ('Content-Length', str(len(payload))),
@@ -68,39 +263,130 @@ def json_response(response, status=200, headers=None):
             base_headers.extend(headers)
     return status, base_headers, payload
 
-def get_db_connection():
-    return pymysql.connect(
+# Частые ошибки собираем один раз при импорте (headers никто не мутирует — respond их только склеивает)
+_RESP_NOT_FOUND = json_response({'error': 'Not Found'}, 404)
+_RESP_UNAUTHORIZED = json_response({'error': 'Unauthorized'}, 401)
+_RESP_FORBIDDEN = json_response({'error': 'Forbidden'}, 403)
+
+def etag_matches(request, etag):
+    inm = request.headers.get('If-None-Match')
+    if not inm:
+        return False
+    if inm.strip() == '*':
+        return True
+    return etag in (t.strip().removeprefix('W/') for t in inm.split(','))
+
+# (conn, idle_since) — уже авторизованные соединения, чтобы не платить за handshake на каждый запрос
+_POOL = Queue(maxsize=DB_POOL_SIZE)
+_POOL_SLOTS = threading.BoundedSemaphore(DB_MAX_CONNECTIONS)
+
+def _connect():
+    return mysql_driver.connect(
         host=DB_HOST,
         user=DB_USER,
         password=DB_PASSWORD,
         database=DB_NAME,
-        cursorclass=pymysql.cursors.DictCursor
+        charset='utf8mb4',
+        cursorclass=DictCursor,
+        # все мутации — одиночные стейтменты, отдельный COMMIT им не нужен
+        autocommit=True,
     )
 
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except mysql_driver.Error:
+        pass
+
+def _release_connection(conn):
+    # драйвер уже закрыл соединение после сетевой ошибки — в пул его не возвращаем
+    if not conn.open:
+        return
+    try:
+        _POOL.put_nowait((conn, time.monotonic()))
+    except Full:
+        conn.close()
+
+@contextmanager
+def get_db_connection():
+    """Соединение из пула; по выходу из with возвращается обратно.
+    Занято уже DB_MAX_CONNECTIONS — ждём, пока какое-нибудь освободится"""
+    with _POOL_SLOTS:
+        try:
+            conn, idle_since = _POOL.get_nowait()
+        except Empty:
+            conn = _connect()
+        else:
+            if time.monotonic() - idle_since > DB_POOL_PING_AFTER:
+                try:
+                    conn.ping()
+                except mysql_driver.Error:
+                    _close_quietly(conn)
+                    conn = _connect()
+
+        broken = False
+        try:
+            yield conn
+        except (mysql_driver.OperationalError, mysql_driver.InterfaceError):
+            # обрыв связи / сервер ушёл: mysqlclient не всегда помечает такое соединение закрытым
+            broken = True
+            raise
+        finally:
+            if broken:
+                _close_quietly(conn)
+            else:
+                _release_connection(conn)
+
 def auth_required(fn):
     def wrapper(self, *args, **kwargs):
         auth_header = self.headers.get('Authorization', '')
         parts = auth_header.split()
         if len(parts) != 2 or parts[0].lower() != 'bearer' or not parts[1].strip():
-            self.respond(*json_response({'error': 'Unauthorized'}, 401))
+            self.respond(*_RESP_UNAUTHORIZED)
             return
 
         token = parts[1].strip()
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT id, username, role FROM users WHERE token=%s", (token,))
-                user = cursor.fetchone()
-
-        if not user:
-            self.respond(*json_response({'error': 'Unauthorized'}, 401))
+        if not _TOKEN_RE.match(token):
+            self.respond(*_RESP_UNAUTHORIZED)
             return
 
-        self.user = user  # {'id': ..., 'username': ..., 'role': ...}
+        user = get_cached_user(token)
+        if user is None:
+            gen = token_cache_generation()
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT id, role FROM users WHERE token=%s", (token,))
+                    user = cursor.fetchone()
+
+            if not user:
+                self.respond(*_RESP_UNAUTHORIZED)
+                return
+            cache_user(token, user, gen)
+
+        self.user = user  # {'id': ..., 'role': ...}
         return fn(self, *args, **kwargs)
     return wrapper
 
 def is_email(s: str) -> bool:
-    return bool(s and EMAIL_RE.match(s))
+    return bool(s and _MATCH_EMAIL(s))
+
+def parse_dmy(raw: str) -> date:
+    """DD.MM.YYYY -> date; ValueError на неверную дату"""
+    # канонический вид разбираем срезами — strptime на каждый вызов заново разбирает формат
+    if len(raw) == 10 and raw[2] == '.' and raw[5] == '.' and (raw[:2] + raw[3:5] + raw[6:]).isdecimal():
+        return date(int(raw[6:]), int(raw[3:5]), int(raw[:2]))
+    # остальное (например 1.2.2024) strptime принимал и раньше — оставляем как было
+    return datetime.strptime(raw, "%d.%m.%Y").date()
+
+# Не зависящая от запроса часть CORS — собираем один раз, а не на каждый ответ
+_CORS_STATIC_HEADERS = (
+    ('Vary', 'Origin'),
+    ('Access-Control-Allow-Methods', 'GET,POST,PUT,DELETE,OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type, Authorization'),
+    ('Access-Control-Max-Age', '86400'),
+    # Для cookies/credentials в dev можно включить, если надо:
+    # ('Access-Control-Allow-Credentials', 'true'),
+)
 
 def cors_headers(request):
     origin = request.headers.get('Origin', '')
@@ -111,22 +397,27 @@ def cors_headers(request):
     headers = []
     if allow_origin or not ALLOWED_ORIGINS:
         headers.append(('Access-Control-Allow-Origin', allow_origin or '*'))
-    headers.extend([
-        ('Vary', 'Origin'),
-        ('Access-Control-Allow-Methods', 'GET,POST,PUT,DELETE,OPTIONS'),
-        ('Access-Control-Allow-Headers', 'Content-Type, Authorization'),
-        ('Access-Control-Max-Age', '86400'),
-        # Для cookies/credentials в dev можно включить, если надо:
-        # ('Access-Control-Allow-Credentials', 'true'),
-    ])
+    headers.extend(_CORS_STATIC_HEADERS)
     return headers
 
 # ================== HTTP HANDLER ==================
 class SimpleAPIHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 — keep-alive: TCP/TLS handshake один на много запросов.
+    # Каждый ответ обязан иметь Content-Length или идти chunked (см. respond/stream_json_array)
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
 
-    def respond(self, code, headers, payload):
+    def parse_request(self):
+        # экземпляр живёт всё keep-alive соединение — сбрасываем состояние каждого запроса
+        self.body_consumed = False
+        return super().parse_request()
+
+    def send_head(self, code, headers):
         # Гарантированно доклеиваем CORS заголовки и удаляем дубликаты по ключу
         ch = cors_headers(self)
+        if not self.body_consumed and self.headers.get('Content-Length', '0') != '0':
+            # тело не дочитали (401 до parse_json и т.п.) — иначе оно станет началом следующего запроса
+            ch.append(('Connection', 'close'))
         # Нормализуем входные headers (support dict)
         if isinstance(headers, dict):
             headers = list(headers.items())
@@ -140,60 +431,111 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
             self.send_header(k, v)
         self.end_headers()
 
+    def respond(self, code, headers, payload):
+        self.send_head(code, headers)
         if code != 204 and self.command != 'HEAD' and payload:
             self.wfile.write(payload)
 
+    def wants_ndjson(self):
+        return 'application/x-ndjson' in self.headers.get('Accept', '')
+
+    def stream_json_array(self, cursor, key=None, tail=None, first=None):
+        """Отдаёт строки курсора JSON-массивом (или {key: [...]}) по мере выборки, не собирая весь ответ в памяти.
+        tail(count, last_row) -> dict — поля, дописываемые в объект после массива (только вместе с key).
+        first — уже выбранная из курсора первая пачка строк; cursor=None — кроме first ничего нет.
+        При Accept: application/x-ndjson — по документу на строку, без обёртки и tail"""
+        ndjson = self.wants_ndjson()
+        # chunked понимают только клиенты HTTP/1.1
+        chunked = self.request_version >= 'HTTP/1.1'
+        ctype = 'application/x-ndjson' if ndjson else 'application/json; charset=utf-8'
+        headers = [('Content-Type', ctype)]
+        if chunked:
+            headers.append(('Transfer-Encoding', 'chunked'))
+        else:
+            # HTTP/1.0: без Content-Length конец тела — это закрытие соединения
+            self.close_connection = True
+        self.send_head(200, headers)
+
+        def write(buf):
+            if chunked:
+                buf = f"{len(buf):X}\r\n".encode() + buf + b"\r\n"
+            self.wfile.write(buf)
+
+        if ndjson:
+            head, sep, lead = b'', b'\n', b''
+        else:
+            head = b'[' if key is None else b'{' + json_dumps(key) + b':['
+            sep, lead = b',', b''
+        count, last_row = 0, None
+        rows = first if first is not None else cursor.fetchmany(STREAM_BATCH_ROWS)
+        while rows:
+            count += len(rows)
+            last_row = rows[-1]
+            parts = [head]
+            for row in rows:
+                parts.append(lead)
+                parts.append(json_dumps(row))
+                lead = sep
+            write(b''.join(parts))
+            head = b''
+            rows = cursor.fetchmany(STREAM_BATCH_ROWS) if cursor is not None else None
+        if ndjson:
+            end = b'\n' if count else b''
+        elif key is None:
+            end = b']'
+        else:
+            extra = tail(count, last_row) if tail else {}
+            end = b']' + b''.join(b',' + json_dumps(k) + b':' + json_dumps(v) for k, v in extra.items()) + b'}'
+        # пустой chunk означал бы конец тела
+        if head + end:
+            write(head + end)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
     # Preflight
     def do_OPTIONS(self):
         self.respond(204, [], b'')
 
-    def do_GET(self):
-        path = urlparse(self.path).path
-
-        if path == '/reviews':
-            return self.get_reviews()
-        elif path == '/places':
-            return self.list_places()
-        elif path == '/me':
-            return self.get_me()
-        elif path == '/users':
-            return self.list_users()
-        else:
-            self.respond(*json_response({'error': 'Not Found'}, 404))
-
-    def do_POST(self):
-        path = urlparse(self.path).path
-
-        if path == '/auth/register':
-            return self.register()
-        elif path == '/auth/login':
-            return self.login()
-        elif path == '/places':
-            return self.create_place()
-        elif path == '/reviews':
-            return self.add_review()
-        else:
-            self.respond(*json_response({'error': 'Not Found'}, 404))
+    # (method, path) -> имя метода-обработчика
+    _ROUTES = {
+        ('GET', '/reviews'): 'get_reviews',
+        ('GET', '/places'): 'list_places',
+        ('GET', '/me'): 'get_me',
+        ('GET', '/users'): 'list_users',
+        ('POST', '/auth/register'): 'register',
+        ('POST', '/auth/login'): 'login',
+        ('POST', '/places'): 'create_place',
+        ('POST', '/reviews'): 'add_review',
+    }
+    # Маршруты с id в пути: (regex, {method: имя обработчика})
+    _PARAM_ROUTES = [
+        (re.compile(r'^/users/([^/]+)/?$'), {'PUT': 'update_user', 'DELETE': 'delete_user'}),
+    ]
 
-    def do_PUT(self):
-        parts = urlparse(self.path).path.strip('/').split('/')
-        if len(parts) == 2 and parts[0] == 'users':
-            try:
-                user_id = int(parts[1])
-            except ValueError:
-                return self.respond(*json_response({'error': 'Invalid user id'}, 400))
-            return self.update_user(user_id)
-        self.respond(*json_response({'error': 'Not Found'}, 404))
+    def _path(self):
+        # для наших путей urlparse избыточен: достаточно отрезать query string
+        p = self.path
+        q = p.find('?')
+        return p if q < 0 else p[:q]
 
-    def do_DELETE(self):
-        parts = urlparse(self.path).path.strip('/').split('/')
-        if len(parts) == 2 and parts[0] == 'users':
-            try:
-                user_id = int(parts[1])
-            except ValueError:
-                return self.respond(*json_response({'error': 'Invalid user id'}, 400))
-            return self.delete_user(user_id)
-        self.respond(*json_response({'error': 'Not Found'}, 404))
+    def _dispatch(self):
+        path = self._path()
+        handler = self._ROUTES.get((self.command, path))
+        if handler is not None:
+            return getattr(self, handler)()
+
+        for pattern, methods in self._PARAM_ROUTES:
+            m = pattern.match(path)
+            if m and self.command in methods:
+                try:
+                    user_id = int(m.group(1))
+                except ValueError:
+                    return self.respond(*json_response({'error': 'Invalid user id'}, 400))
+                return getattr(self, methods[self.command])(user_id)
+
+        self.respond(*_RESP_NOT_FOUND)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
 
     # ========== AUTH ROUTES ==========
     def register(self):
@@ -206,8 +548,8 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
         if not login or not passwd or role not in ALLOWED_SELF_REGISTER_ROLES or not is_email(email):
             return self.respond(*json_response({'error': 'Missing fields or invalid role/email'}, 400))
 
-        password_hash = hashlib.sha256(passwd.encode()).hexdigest()
-        token = generate_token(login)
+        password_hash = hash_password(passwd)
+        token = generate_token()
 
         try:
             with get_db_connection() as conn:
@@ -216,13 +558,12 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                         "INSERT INTO users (username, email, password, role, token) VALUES (%s, %s, %s, %s, %s)",
                         (login, email, password_hash, role, token)
                     )
-                    conn.commit()
                     self.respond(*json_response({
                         'id': cursor.lastrowid,
                         'token': token,
                         'user': {'id': cursor.lastrowid, 'username': login, 'email': email, 'role': role}
                     }, 201))
-        except pymysql.err.IntegrityError:
+        except mysql_driver.IntegrityError:
             self.respond(*json_response({'error': 'User exists'}, 409))
 
     def login(self):
@@ -232,46 +573,77 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
         if not login or not passwd:
             return self.respond(*json_response({'error': 'Missing fields'}, 400))
 
-        pwd_hash = hashlib.sha256(passwd.encode()).hexdigest()
-
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT id, username, email, role, password FROM users WHERE username=%s", (login,))
-                user = cursor.fetchone()
-                if not user or user['password'] != pwd_hash:
-                    return self.respond(*json_response({'error': 'Invalid credentials'}, 401))
+        # argon2 (~19 MiB, десятки мс) считаем вне get_db_connection: иначе каждый логин
+        # держит слот _POOL_SLOTS на всё время KDF и при наплыве логинов встают остальные эндпоинты
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT id, username, email, role, password FROM users WHERE username=%s", (login,))
+            user = cursor.fetchone()
 
-                token = generate_token(login)
+        if user:
+            ok, needs_rehash = verify_password(user['password'], passwd)
+        else:
+            _dummy_verify(passwd)
+            ok = False
+        if not ok:
+            return self.respond(*json_response({'error': 'Invalid credentials'}, 401))
+
+        token = generate_token()
+        new_hash = hash_password(passwd) if needs_rehash else None
+
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            # пока считали хэш, пароль могли сменить через PUT /users/{id} —
+            # перезаписываем только тот хэш, который проверяли
+            if new_hash:
+                cursor.execute(
+                    "UPDATE users SET token=%s, password=%s WHERE id=%s AND password=%s",
+                    (token, new_hash, user['id'], user['password'])
+                )
+            if not new_hash or cursor.rowcount == 0:
                 cursor.execute("UPDATE users SET token=%s WHERE id=%s", (token, user['id']))
-                conn.commit()
-
-                return self.respond(*json_response({
-                    'token': token,
-                    'user': {
-                        'id': user['id'],
-                        'username': user['username'],
-                        'email': user['email'],
-                        'role': user['role'],
-                    }
-                }, 200))
+        evict_user_tokens(user['id'])
+
+        return self.respond(*json_response({
+            'token': token,
+            'user': {
+                'id': user['id'],
+                'username': user['username'],
+                'email': user['email'],
+                'role': user['role'],
+            }
+        }, 200))
 
     def require_admin(self):
         if not getattr(self, "user", None):
-            self.respond(*json_response({'error': 'Unauthorized'}, 401))
+            self.respond(*_RESP_UNAUTHORIZED)
             return False
         uid = self.user.get('id')
         role = self.user.get('role')
         if uid == 1 or role == 'admin':
             return True
-        self.respond(*json_response({'error': 'Forbidden'}, 403))
+        self.respond(*_RESP_FORBIDDEN)
         return False
 
     # ========== PLACES =============
     def list_places(self):
-        with get_db_connection() as conn, conn.cursor() as c:
-            c.execute("SELECT id, name, description, lat, lon, owner_id FROM places ORDER BY id DESC")
-            rows = c.fetchall()
-        return self.respond(*json_response(rows, 200))
+        with _PLACES_CACHE_LOCK:
+            etag, response, gen = _PLACES_CACHE['etag'], _PLACES_CACHE['response'], _PLACES_CACHE['gen']
+
+        if response is None:
+            # server-side курсор: строки кодируем по одной, без промежуточного списка
+            with get_db_connection() as conn, conn.cursor(SSDictCursor) as c:
+                c.execute("SELECT id, name, description, lat, lon, owner_id FROM places ORDER BY id DESC")
+                payload = b'[' + b','.join(map(json_dumps, c)) + b']'
+            response = encoded_json_response(payload, 200)
+            etag = '"' + hashlib.blake2b(response[2], digest_size=8).hexdigest() + '"'
+            with _PLACES_CACHE_LOCK:
+                if _PLACES_CACHE['gen'] == gen:
+                    _PLACES_CACHE['etag'], _PLACES_CACHE['response'] = etag, response
+
+        cache_headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+        if etag_matches(self, etag):
+            return self.respond(304, cache_headers, b'')
+        status, headers, payload = response
+        return self.respond(status, headers + cache_headers, payload)
 
     @auth_required
     def create_place(self):
@@ -295,7 +667,7 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                     "INSERT INTO places (name, description, owner_id, lat, lon) VALUES (%s,%s,%s,%s,%s)",
                     (name, desc, self.user['id'], lat, lon)
                 )
-                conn.commit()
+                invalidate_places_cache()
                 self.respond(*json_response({'id': cursor.lastrowid}, 201))
 
     # Добавление отзыва — только авторизованные
@@ -309,6 +681,10 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                 raise ValueError
         except (ValueError, AttributeError):
             return self.respond(*json_response({'error': 'Invalid place id'}, 400))
+        # place_id первым встречает БД в INSERT; вне диапазона INT strict-режим
+        # даёт DataError (1264), а не IntegrityError — такого места просто нет
+        if place_id > INT_MAX:
+            return self.respond(*json_response({'error': 'Place not found'}, 404))
 
         try:
             body_user_id = int((data.get('userid') or '').strip())
@@ -316,12 +692,7 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
             return self.respond(*json_response({'error': 'Invalid user id'}, 400))
 
         if body_user_id != self.user['id']:
-            return self.respond(*json_response({'error': 'Forbidden'}, 403))
-
-        with get_db_connection() as conn, conn.cursor() as c:
-            c.execute("SELECT 1 FROM places WHERE id=%s", (place_id,))
-            if not c.fetchone():
-                return self.respond(*json_response({'error': 'Place not found'}, 404))
+            return self.respond(*_RESP_FORBIDDEN)
 
         text = (data.get('text') or '').strip()
         if not text:
@@ -332,27 +703,30 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
         raw_date = (data.get('date') or '').strip()
         if raw_date:
             try:
-                created_dt = datetime.strptime(raw_date, "%d.%m.%Y").date()
+                created_dt = parse_dmy(raw_date)
             except ValueError:
                 return self.respond(*json_response({'error': 'Invalid date format, expected DD.MM.YYYY'}, 400))
         else:
             created_dt = date.today()
 
+        # существование места проверяет FK fk_reviews_place, отдельный SELECT не нужен;
+        # все поля ответа известны здесь же — перечитывать вставленную строку незачем
         with get_db_connection() as conn, conn.cursor() as c:
-            c.execute(
-                "INSERT INTO reviews (place_id, user_id, text, created_at) VALUES (%s,%s,%s,%s)",
-                (place_id, self.user['id'], text, created_dt)
-            )
+            try:
+                c.execute(
+                    "INSERT INTO reviews (place_id, user_id, text, created_at) VALUES (%s,%s,%s,%s)",
+                    (place_id, self.user['id'], text, created_dt)
+                )
+            except mysql_driver.IntegrityError:
+                return self.respond(*json_response({'error': 'Place not found'}, 404))
             new_id = c.lastrowid
-            conn.commit()
-
-            c.execute("""
-            SELECT id, user_id, text,
-                    DATE_FORMAT(created_at, '%%d.%%m.%%Y') AS date
-            FROM reviews WHERE id=%s
-            """, (new_id,))
-            review = c.fetchone()
 
+        review = {
+            'id': new_id,
+            'user_id': self.user['id'],
+            'text': text,
+            'date': created_dt.strftime('%d.%m.%Y'),
+        }
         return self.respond(*json_response({'review': review}, 201))
 
     # Получение отзывов по месту — публично
@@ -361,12 +735,14 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
         qs = dict((k, v[0]) for k, v in parse_qs(parsed.query).items())
         raw_id = qs.get('id')
 
-        if raw_id is None:
+        # Основная форма — /reviews?id=N; id в JSON-теле GET читаем только если тело вообще есть
+        if raw_id is None and self.headers.get('Content-Length', '0') != '0':
             try:
-                body = parse_json(self) or {}
-            except Exception:
-                body = {}
-            raw_id = body.get('id', body.get('place_id'))
+                body = parse_json(self)
+            except ValueError:
+                body = None
+            if isinstance(body, dict):
+                raw_id = body.get('id', body.get('place_id'))
 
         try:
             place_id = int(str(raw_id).strip())
@@ -375,38 +751,59 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
         except (TypeError, ValueError, AttributeError):
             return self.respond(*json_response({'error': 'Invalid place id'}, 400))
 
-        with get_db_connection() as conn, conn.cursor() as c:
-            c.execute("SELECT 1 FROM places WHERE id=%s", (place_id,))
-            if not c.fetchone():
-                return self.respond(*json_response({'error': 'Place not found'}, 404))
-
+        # Один запрос вместо проверки места + выборки: нет строк — нет места,
+        # одна строка с id=NULL — место есть, отзывов нет.
+        # Статус решаем по первой пачке, остальное отдаём потоком
+        with get_db_connection() as conn, conn.cursor(SSDictCursor) as c:
             c.execute("""
-            SELECT id,
-                    user_id   AS userid,
-                    text,
-                    DATE_FORMAT(created_at, '%%d.%%m.%%Y') AS date
-            FROM reviews
-            WHERE place_id=%s
-            ORDER BY id DESC
+            SELECT CAST(r.id AS CHAR)      AS id,
+                    CAST(r.user_id AS CHAR) AS userid,
+                    r.text,
+                    DATE_FORMAT(r.created_at, '%%d.%%m.%%Y') AS date
+            FROM places p
+            LEFT JOIN reviews r ON r.place_id = p.id
+            WHERE p.id=%s
+            ORDER BY r.id DESC
             """, (place_id,))
-            rows = c.fetchall()
-
-        for r in rows:
-            r['id'] = str(r['id'])
-            r['userid'] = str(r['userid'])
-
-        return self.respond(*json_response({'reviews': rows}, 200))
+            first = c.fetchmany(STREAM_BATCH_ROWS)
+            # Пишем в сокет, держа соединение и слот _POOL_SLOTS, только когда отзывов больше
+            # одной пачки: /reviews публичный, медленный клиент на мелком ответе слот не держит
+            if len(first) == STREAM_BATCH_ROWS:
+                return self.stream_json_array(c, 'reviews', first=first)
+
+        if not first:
+            return self.respond(*json_response({'error': 'Place not found'}, 404))
+        if first[0]['id'] is None:
+            first = []
+        return self.stream_json_array(None, 'reviews', first=first)
 
     # ========== USERS ==============
     @auth_required
     def list_users(self):
         if not self.require_admin():
             return
+
+        # keyset-пагинация: ?after=<последний id прошлой страницы>&limit=N
+        qs = parse_qs(urlparse(self.path).query)
+        try:
+            after = int(qs.get('after', ['0'])[0])
+            limit = int(qs.get('limit', [str(USERS_PAGE_DEFAULT)])[0])
+            if after < 0 or limit <= 0:
+                raise ValueError
+        except ValueError:
+            return self.respond(*json_response({'error': 'Invalid after/limit'}, 400))
+        limit = min(limit, USERS_PAGE_MAX)
+
+        def next_cursor(count, last_row):
+            return {'next': last_row['id'] if count == limit else None}
+
         with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT id, username, role FROM users ORDER BY id ASC")
-                rows = cursor.fetchall()
-                self.respond(*json_response({'users': rows}, 200))
+            with conn.cursor(SSDictCursor) as cursor:
+                cursor.execute(
+                    "SELECT id, username, role FROM users WHERE id > %s ORDER BY id ASC LIMIT %s",
+                    (after, limit)
+                )
+                return self.stream_json_array(cursor, 'users', tail=next_cursor)
 
     @auth_required
     def update_user(self, user_id: int):
@@ -422,22 +819,22 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
             username = data['username']
             if not username or not isinstance(username, str):
                 return self.respond(*json_response({'error': 'Invalid username'}, 400))
-            fields.append("username=%s")
+            fields.append('username')
             values.append(username)
 
         if 'passwd' in data:
             passwd = data['passwd']
             if not passwd or not isinstance(passwd, str):
                 return self.respond(*json_response({'error': 'Invalid passwd'}, 400))
-            pwd_hash = hashlib.sha256(passwd.encode()).hexdigest()
-            fields.append("password=%s")
+            pwd_hash = hash_password(passwd)
+            fields.append('password')
             values.append(pwd_hash)
 
         if 'role' in data:
             role = data['role']
             if role not in allowed_roles:
                 return self.respond(*json_response({'error': 'Invalid role'}, 400))
-            fields.append("role=%s")
+            fields.append('role')
             values.append(role)
 
         if not fields:
@@ -447,10 +844,10 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
 
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute("UPDATE users SET " + ", ".join(fields) + " WHERE id=%s", values)
+                cursor.execute(_USER_UPDATE_SQL[frozenset(fields)], values)
                 if cursor.rowcount == 0:
                     return self.respond(*json_response({'error': 'User not found'}, 404))
-                conn.commit()
+                evict_user_tokens(user_id)
                 cursor.execute("SELECT id, username, role FROM users WHERE id=%s", (user_id,))
                 user = cursor.fetchone()
                 return self.respond(*json_response({'updated': user}, 200))
@@ -466,8 +863,10 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                 cursor.execute("DELETE FROM users WHERE id=%s", (user_id,))
                 if cursor.rowcount == 0:
                     return self.respond(*json_response({'error': 'User not found'}, 404))
-                conn.commit()
-                return self.respond(*json_response({}, 204))
+                evict_user_tokens(user_id)
+                # places.owner_id уходит в NULL по ON DELETE SET NULL
+                invalidate_places_cache()
+                return self.respond(204, [], b'')
 
     @auth_required
     def get_me(self):
@@ -482,16 +881,22 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
 
 # ================== SERVER BOOT ===================
 if __name__ == '__main__':
-    # USE_TLS=1 включит HTTPS, иначе HTTP (dev)
+    # USE_TLS=1 включит HTTPS прямо в процессе, иначе HTTP (dev или за nginx)
     use_tls = os.getenv('USE_TLS', '0') == '1'
-    httpd = HTTPServer(('0.0.0.0', 8443), SimpleAPIHandler)
+    httpd = ThreadingHTTPServer((LISTEN_HOST, LISTEN_PORT), SimpleAPIHandler)
 
     if use_tls:
         context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        # TLS 1.2 оставляем ради Android < 10; для него — только ECDHE + AEAD (AES-GCM идёт через AES-NI).
+        # Session tickets включены по умолчанию — переподключения резюмируются без полного handshake
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        context.set_ciphers('ECDHE+AESGCM:ECDHE+CHACHA20')
+        context.options |= ssl.OP_NO_COMPRESSION
         context.load_cert_chain(certfile=CERT_FILE, keyfile=KEY_FILE)
-        httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
-        print("Server running at https://0.0.0.0:8443")
+        # handshake делаем в потоке запроса, а не в accept() главного потока
+        httpd.socket = context.wrap_socket(httpd.socket, server_side=True, do_handshake_on_connect=False)
+        print(f"Server running at https://{LISTEN_HOST}:{LISTEN_PORT}")
     else:
-        print("Server running at http://0.0.0.0:8443")
+        print(f"Server running at http://{LISTEN_HOST}:{LISTEN_PORT}")
 
     httpd.serve_forever()
@@ -0,0 +1,3 @@
+-- Для БД, созданных до появления индекса в init.sql:
+-- auth_required ищет пользователя по токену на каждый запрос
+CREATE UNIQUE INDEX idx_users_token ON users(token);
@@ -0,0 +1,2 @@
+-- argon2id-хэши ($argon2id$v=19$m=...,t=...,p=...$salt$hash) длиннее 64 символов sha256 hexdigest
+ALTER TABLE users MODIFY password VARCHAR(255) NOT NULL;